@@ -0,0 +1,13 @@
+-- Supabase objects used by main.py.
+-- Run in the Supabase SQL editor after the activity_logs table exists.
+
+-- Distinct activity/unit pairs with their usage counts, used to build the
+-- Gemini prompt, so the app doesn't download every logged set just to
+-- deduplicate and rank names.
+CREATE OR REPLACE VIEW known_styles WITH (security_invoker = true) AS
+SELECT activity_name, unit, count(*) AS uses
+FROM activity_logs
+GROUP BY activity_name, unit;
+
+-- Lets /recent read the newest rows straight off the index instead of sorting the table.
+CREATE INDEX IF NOT EXISTS activity_logs_created_at_desc ON activity_logs (created_at DESC);
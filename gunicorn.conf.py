@@ -0,0 +1,10 @@
+import os
+
+# Gemini and Supabase calls block on network I/O, so each worker serves
+# requests from a thread pool and slow API round trips overlap.
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = 60
+keepalive = 30
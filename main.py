@@ -1,138 +1,282 @@
 import os
-import re
-import json
+import copy
+import atexit
+import functools
+import logging
+import logging.handlers
+import queue
+import time
+import threading
+from collections import Counter, OrderedDict
 from datetime import datetime
+from typing import TypedDict
+import orjson
 from flask import Flask, render_template, request, jsonify
-import google.generativeai as genai
-from supabase import create_client
+from flask.json.provider import DefaultJSONProvider
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Log records are written to stderr by a background thread, so request
+# threads never block on the stream
+_log_queue = queue.SimpleQueue()
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+logger = logging.getLogger('workout_logger')
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+class OrjsonProvider(DefaultJSONProvider):
+    def _options(self, sort_keys, indent):
+        option = 0
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        # orjson only supports two-space indentation
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        option = self._options(kwargs.get('sort_keys', self.sort_keys), kwargs.get('indent'))
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response instead of decoding to str and re-encoding
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        option = self._options(self.sort_keys, indent) | orjson.OPT_APPEND_NEWLINE
+
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=option),
+            mimetype=self.mimetype
+        )
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # Configuration
 GEMINI_MODEL_NAME = 'gemini-2.5-flash'
+REQUIRED_ENV_VARS = ('GOOGLE_API_KEY', 'SUPABASE_URL', 'SUPABASE_ANON_KEY')
+KNOWN_STYLES_TTL_SECONDS = 300
+KNOWN_STYLES_RETRY_SECONDS = 10
+KNOWN_STYLES_PROMPT_LIMIT = 100
+PARSE_CACHE_MAX_ENTRIES = 1024
+RECENT_CACHE_TTL_SECONDS = 5
 
-# Initialize APIs
-def initialize_apis():
-    try:
-        genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
-        gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+# Static instructions come first and only the date and input vary per request,
+# so the prefix can be built once per known-styles refresh
+GEMINI_PROMPT_PREFIX_TEMPLATE = """
+Convert the following workout description into structured JSON.
+Extract the date from the input if specified and include it in 'YYYY-MM-DD' format. If no date is specified, use today's date.
+Use the following known activity names: [{activity_list}]
+Use the following known units: [{unit_list}]
+For each exercise and unit, if a similar name or unit already exists in the known list, use the exact same spelling and format from the list. Do not invent new variants or plural forms. Only create a new name or unit if it is clearly a new activity or metric.
+Return one exercise entry per set, e.g. {{"activity_name": "pull-up", "set_number": 1, "metric_type": "reps", "value": 5, "unit": "reps"}}.
+"""
+
+GEMINI_PROMPT_INPUT_TEMPLATE = """
+Today's date is {current_date}.
+Input: "{user_input}"
+"""
 
-        supabase_url = os.getenv('SUPABASE_URL')
-        supabase_key = os.getenv('SUPABASE_ANON_KEY')
-        supabase = create_client(supabase_url, supabase_key)
+class ExerciseSet(TypedDict):
+    activity_name: str
+    set_number: int
+    metric_type: str
+    value: float
+    unit: str
 
-        return gemini_model, supabase
-    except Exception as e:
-        print(f"Error initializing APIs: {e}")
-        return None, None
+class ParsedWorkout(TypedDict):
+    date: str
+    exercises: list[ExerciseSet]
+
+# Constrain Gemini to raw JSON matching ParsedWorkout, so responses need no cleanup
+GEMINI_GENERATION_CONFIG = {
+    'response_mime_type': 'application/json',
+    'response_schema': ParsedWorkout
+}
+
+# Fail at import, so a misconfigured deploy crashes while gunicorn boots its
+# workers instead of serving 500s; only client creation below is deferred
+_missing_env_vars = [name for name in REQUIRED_ENV_VARS if not os.getenv(name)]
+if _missing_env_vars:
+    raise RuntimeError(f"Missing environment variables: {', '.join(_missing_env_vars)}")
+
+# Initialize APIs on first use so importing the module (e.g. gunicorn booting
+# workers) doesn't wait on client setup; failures are retried on the next call.
+# The SDKs are imported here too, keeping their import cost off startup.
+@functools.lru_cache(maxsize=1)
+def get_clients():
+    import google.generativeai as genai
+    from supabase import create_client
+
+    genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+    gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME, generation_config=GEMINI_GENERATION_CONFIG)
 
-gemini_model, supabase = initialize_apis()
+    supabase_url = os.getenv('SUPABASE_URL')
+    supabase_key = os.getenv('SUPABASE_ANON_KEY')
+    supabase = create_client(supabase_url, supabase_key)
+
+    return gemini_model, supabase
 
 class WorkoutLogger:
     def __init__(self, gemini_model, supabase_client):
         self.gemini_model = gemini_model
         self.supabase = supabase_client
+        self._known_styles = ([], [])
+        self._prompt_prefix = self.build_prompt_prefix([], [])
+        self._known_styles_expires = 0.0
+        self._known_styles_lock = threading.Lock()
+        self._parse_cache = OrderedDict()
+        self._parse_cache_lock = threading.Lock()
 
     def fetch_known_styles(self):
-        try:
-            activity_result = self.supabase.table('activity_logs').select('activity_name').execute()
-            unit_result = self.supabase.table('activity_logs').select('unit').execute()
+        if time.monotonic() < self._known_styles_expires:
+            return self._known_styles
 
-            known_activities = sorted(set(log['activity_name'] for log in activity_result.data if log.get('activity_name')))
-            known_units = sorted(set(log['unit'] for log in unit_result.data if log.get('unit')))
+        # Only one thread refreshes; the others wait and reuse its result
+        with self._known_styles_lock:
+            if time.monotonic() < self._known_styles_expires:
+                return self._known_styles
 
-            return known_activities, known_units
-        except Exception as e:
-            print(f"Error fetching known styles: {e}")
-            return [], []
+            try:
+                # Ordered so that if PostgREST caps the row count, the least-used pairs are the ones dropped
+                result = self.supabase.table('known_styles').select('activity_name,unit,uses').order('uses', desc=True).execute()
 
-    def generate_gemini_prompt(self, user_input: str, current_date: str) -> str:
-        known_activities, known_units = self.fetch_known_styles()
+                # Most-used names first, so the prompt spends its tokens on likely matches
+                activity_uses = Counter()
+                unit_uses = Counter()
+                for row in result.data:
+                    if row.get('activity_name'):
+                        activity_uses[row['activity_name']] += row['uses']
+                    if row.get('unit'):
+                        unit_uses[row['unit']] += row['uses']
+
+                known_activities = [name for name, _ in activity_uses.most_common(KNOWN_STYLES_PROMPT_LIMIT)]
+                known_units = [unit for unit, _ in unit_uses.most_common(KNOWN_STYLES_PROMPT_LIMIT)]
+            except Exception:
+                logger.exception("Error fetching known styles")
+                # Back off so concurrent requests reuse the last good lists
+                # instead of queueing behind one failing query after another
+                self._known_styles_expires = time.monotonic() + KNOWN_STYLES_RETRY_SECONDS
+                return self._known_styles
+
+            self._set_known_styles(known_activities, known_units)
+            self._known_styles_expires = time.monotonic() + KNOWN_STYLES_TTL_SECONDS
+            return self._known_styles
+
+    def _set_known_styles(self, known_activities, known_units, clear_parse_cache=True):
+        # Callers hold _known_styles_lock
+        if clear_parse_cache and (known_activities, known_units) != self._known_styles:
+            # Cached parses were made against the old lists
+            with self._parse_cache_lock:
+                self._parse_cache.clear()
+
+        self._prompt_prefix = self.build_prompt_prefix(known_activities, known_units)
+        self._known_styles = (known_activities, known_units)
+
+    def remember_known_styles(self, rows):
+        # Add newly logged names to the cached lists so the next prompt offers
+        # them without waiting for the TTL refresh. Gemini produced these names
+        # itself, so earlier cached parses stay valid.
+        with self._known_styles_lock:
+            known_activities, known_units = self._known_styles
+            new_activities = [a for a in dict.fromkeys(row['activity_name'] for row in rows) if a and a not in known_activities]
+            new_units = [u for u in dict.fromkeys(row['unit'] for row in rows) if u and u not in known_units]
+
+            if new_activities or new_units:
+                self._set_known_styles(known_activities + new_activities, known_units + new_units, clear_parse_cache=False)
+
+    @staticmethod
+    def build_prompt_prefix(known_activities, known_units) -> str:
         activity_list = ', '.join(f'"{a}"' for a in known_activities)
         unit_list = ', '.join(f'"{u}"' for u in known_units)
 
-        return f"""
-Today's date is {current_date}.
-Convert the following workout description into structured JSON.
-Extract the date from the input if specified and include it in 'YYYY-MM-DD' format. If no date is specified, use today's date.
-Use the following known activity names: [{activity_list}]
-Use the following known units: [{unit_list}]
-For each exercise and unit, if a similar name or unit already exists in the known list, use the exact same spelling and format from the list. Do not invent new variants or plural forms. Only create a new name or unit if it is clearly a new activity or metric.
-Return ONLY the JSON and no additional text.
+        return GEMINI_PROMPT_PREFIX_TEMPLATE.format(activity_list=activity_list, unit_list=unit_list)
 
-Input: "{user_input}"
+    def generate_gemini_prompt(self, user_input: str, current_date: str) -> str:
+        self.fetch_known_styles()
+        return self._prompt_prefix + GEMINI_PROMPT_INPUT_TEMPLATE.format(
+            current_date=current_date,
+            user_input=user_input
+        )
 
-Output format:
-{{
-  "date": "YYYY-MM-DD",
-  "user_id": "default_user",
-  "username": "User",
-  "raw_input": "{user_input}",
-  "exercises": [
-    {{
-      "activity_name": "pull-up",
-      "set_number": 1,
-      "metric_type": "reps",
-      "value": 5,
-      "unit": "reps"
-    }}
-  ]
-}}
-"""
+    def _get_cached_parse(self, cache_key):
+        with self._parse_cache_lock:
+            workout_data = self._parse_cache.get(cache_key)
+            if workout_data is not None:
+                self._parse_cache.move_to_end(cache_key)
+            return workout_data
+
+    def _cache_parse(self, cache_key, workout_data):
+        with self._parse_cache_lock:
+            self._parse_cache[cache_key] = workout_data
+            if len(self._parse_cache) > PARSE_CACHE_MAX_ENTRIES:
+                self._parse_cache.popitem(last=False)
 
     def parse_input(self, user_input: str, current_date: str = None) -> dict:
         if current_date is None:
             current_date = datetime.now().strftime('%Y-%m-%d')
 
-        try:
+        # Relative dates in the input resolve against current_date, so it is part of the key
+        cache_key = (' '.join(user_input.lower().split()), current_date)
+        workout_data = self._get_cached_parse(cache_key)
+
+        if workout_data is None:
+            # Failures propagate to the route, which logs them with the traceback
             prompt = self.generate_gemini_prompt(user_input, current_date)
             response = self.gemini_model.generate_content(prompt)
-            response_text = response.text.strip()
+            workout_data = orjson.loads(response.text)
+            self._cache_parse(cache_key, workout_data)
 
-            try:
-                return json.loads(response_text)
-            except json.JSONDecodeError:
-                match = re.search(r'{.*}', response_text, re.DOTALL)
-                if match:
-                    return json.loads(match.group(0))
-                raise ValueError("Could not parse JSON from Gemini response")
-        except Exception as e:
-            print(f"Error parsing input: {e}")
-            raise
+        workout_data = copy.deepcopy(workout_data)
+        workout_data['raw_input'] = user_input
+        return workout_data
 
     def log_workout(self, workout_data: dict) -> dict:
         try:
-            logged_exercises = []
-            rows_to_insert = []
-
-            for exercise in workout_data.get('exercises', []):
-                row = {
-                    'date': workout_data.get('date'),
+            # Fields shared by every set in the workout are resolved once
+            workout_fields = {
+                'date': workout_data.get('date'),
+                'user_id': workout_data.get('user_id', 'default_user'),
+                'username': workout_data.get('username', 'User'),
+                'raw_input': workout_data.get('raw_input', ''),
+                'notes': None
+            }
+            rows_to_insert = [
+                {
+                    **workout_fields,
                     'activity_name': exercise.get('activity_name'),
                     'set_number': exercise.get('set_number', 1),
                     'metric_type': exercise.get('metric_type'),
                     'value': exercise.get('value'),
-                    'unit': exercise.get('unit'),
-                    'user_id': workout_data.get('user_id', 'default_user'),
-                    'username': workout_data.get('username', 'User'),
-                    'raw_input': workout_data.get('raw_input', ''),
-                    'notes': None
-                }
-                rows_to_insert.append(row)
-                logged_exercises.append({
-                    'exercise': exercise.get('activity_name'),
-                    'set': exercise.get('set_number', 1),
-                    'metric_type': exercise.get('metric_type'),
-                    'value': exercise.get('value'),
                     'unit': exercise.get('unit')
-                })
+                }
+                for exercise in workout_data.get('exercises', [])
+            ]
+            logged_exercises = [
+                {
+                    'exercise': row['activity_name'],
+                    'set': row['set_number'],
+                    'metric_type': row['metric_type'],
+                    'value': row['value'],
+                    'unit': row['unit']
+                }
+                for row in rows_to_insert
+            ]
 
             if rows_to_insert:
                 self.supabase.table('activity_logs').insert(rows_to_insert).execute()
+                self.remember_known_styles(rows_to_insert)
 
             return {
                 'success': True,
@@ -140,17 +284,31 @@ Output format:
                 'exercises': logged_exercises
             }
         except Exception as e:
-            print(f"Error logging workout: {e}")
+            logger.exception("Error logging workout")
             return {'success': False, 'error': str(e)}
 
-workout_logger = WorkoutLogger(gemini_model, supabase)
+@functools.lru_cache(maxsize=1)
+def get_workout_logger():
+    return WorkoutLogger(*get_clients())
+
+# (expires, workouts) for /recent; reset whenever this worker logs a workout.
+# /log bumps the generation so a /recent query already in flight doesn't
+# store rows read before the insert.
+_recent_workouts_cache = (0.0, None)
+_recent_workouts_generation = 0
+_recent_workouts_lock = threading.Lock()
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/healthz')
+def healthz():
+    return '', 204
+
 @app.route('/log', methods=['POST'])
 def log_workout():
+    global _recent_workouts_cache, _recent_workouts_generation
     try:
         data = request.get_json()
         user_input = data.get('input', '') or data.get('workout', '')
@@ -159,32 +317,50 @@ def log_workout():
         if not user_input:
             return jsonify({'success': False, 'error': 'No workout input provided'}), 400
 
+        workout_logger = get_workout_logger()
         parsed_workout = workout_logger.parse_input(user_input)
         result = workout_logger.log_workout(parsed_workout)
+        if result['success']:
+            with _recent_workouts_lock:
+                _recent_workouts_generation += 1
+                _recent_workouts_cache = (0.0, None)
         return jsonify(result)
     except Exception as e:
-        print(f"Error in log_workout: {e}")
+        logger.exception("Error in log_workout")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/recent')
 def recent_workouts():
+    global _recent_workouts_cache
     try:
-        result = supabase.table('activity_logs').select('*').order('created_at', desc=True).limit(20).execute()
-        workouts = []
-        for log in result.data:
-            workouts.append({
-                'date': log['date'],
-                'activity_name': log['activity_name'],
-                'set_number': log['set_number'],
-                'metric_type': log['metric_type'],
-                'value': log['value'],
-                'unit': log['unit'],
-                'raw_input': log['raw_input']
-            })
-        return jsonify({'success': True, 'workouts': workouts})
+        expires, workouts = _recent_workouts_cache
+        if workouts is not None and time.monotonic() < expires:
+            server_timing = 'cache;desc="hit"'
+        else:
+            generation = _recent_workouts_generation
+            _, supabase = get_clients()
+            started = time.perf_counter()
+            result = supabase.table('activity_logs').select('date,activity_name,set_number,metric_type,value,unit,raw_input').order('created_at', desc=True).limit(20).execute()
+            server_timing = f'db;dur={(time.perf_counter() - started) * 1000:.1f}'
+
+            # The select already returns exactly the fields the client needs
+            workouts = result.data
+            with _recent_workouts_lock:
+                if generation == _recent_workouts_generation:
+                    _recent_workouts_cache = (time.monotonic() + RECENT_CACHE_TTL_SECONDS, workouts)
+
+        response = jsonify({'success': True, 'workouts': workouts})
+        response.headers['Cache-Control'] = f'public, max-age={RECENT_CACHE_TTL_SECONDS}'
+        response.headers['Server-Timing'] = server_timing
+        # Lets clients revalidate with If-None-Match and get an empty 304
+        response.add_etag()
+        return response.make_conditional(request)
     except Exception as e:
-        print(f"Error getting recent workouts: {e}")
+        logger.exception("Error getting recent workouts")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Local development only; production runs `gunicorn main:app` (see gunicorn.conf.py).
+# Set FLASK_DEBUG=1 for the reloader and debugger.
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
+    get_clients()
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,115 @@
+import os
+import unittest
+from types import SimpleNamespace
+
+import orjson
+
+for name in ('GOOGLE_API_KEY', 'SUPABASE_URL', 'SUPABASE_ANON_KEY'):
+    os.environ.setdefault(name, 'test')
+
+import main
+
+
+class FakeGeminiModel:
+    def __init__(self, workout):
+        self.workout = workout
+        self.calls = 0
+
+    def generate_content(self, prompt):
+        self.calls += 1
+        return SimpleNamespace(text=orjson.dumps(self.workout).decode())
+
+
+class FakeQuery:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+
+    def select(self, columns):
+        return self
+
+    def order(self, column, desc=False):
+        return self
+
+    def limit(self, count):
+        return self
+
+    def insert(self, rows):
+        self.client.inserted.extend(rows)
+        return self
+
+    def execute(self):
+        if self.table == 'known_styles':
+            return SimpleNamespace(data=self.client.known_styles)
+        if self.client.on_execute:
+            self.client.on_execute()
+        return SimpleNamespace(data=[])
+
+
+class FakeSupabase:
+    def __init__(self, known_styles):
+        self.known_styles = known_styles
+        self.inserted = []
+        self.on_execute = None
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+class OrjsonProviderTest(unittest.TestCase):
+    def test_response_and_dumps(self):
+        with main.app.app_context():
+            response = main.jsonify({'b': 1, 'a': [1, 2]})
+            self.assertEqual(response.mimetype, 'application/json')
+            self.assertEqual(response.get_data(), b'{"a":[1,2],"b":1}\n')
+            self.assertEqual(main.app.json.dumps({'b': 1, 'a': 2}, sort_keys=False), '{"b":1,"a":2}')
+            self.assertEqual(main.app.json.dumps({'a': 1}, indent=2), '{\n  "a": 1\n}')
+
+
+class WorkoutLoggerCacheTest(unittest.TestCase):
+    def test_logging_new_activity_keeps_parse_cache(self):
+        gemini = FakeGeminiModel({
+            'date': '2026-01-01',
+            'exercises': [{'activity_name': 'push-up', 'set_number': 1, 'metric_type': 'reps', 'value': 10, 'unit': 'reps'}]
+        })
+        supabase = FakeSupabase([{'activity_name': 'pull-up', 'unit': 'reps', 'uses': 3}])
+        logger = main.WorkoutLogger(gemini, supabase)
+
+        workout = logger.parse_input('10 pushups', '2026-01-01')
+        self.assertTrue(logger.log_workout(workout)['success'])
+        self.assertIn('push-up', logger.fetch_known_styles()[0])
+
+        logger.parse_input('10 pushups', '2026-01-01')
+        self.assertEqual(gemini.calls, 1)
+
+
+class RecentWorkoutsCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.supabase = FakeSupabase([])
+        self.gemini = FakeGeminiModel({
+            'date': '2026-01-01',
+            'exercises': [{'activity_name': 'squat', 'set_number': 1, 'metric_type': 'reps', 'value': 5, 'unit': 'reps'}]
+        })
+        self.workout_logger = main.WorkoutLogger(self.gemini, self.supabase)
+        self.originals = (main.get_clients, main.get_workout_logger)
+        main.get_clients = lambda: (self.gemini, self.supabase)
+        main.get_workout_logger = lambda: self.workout_logger
+        main._recent_workouts_cache = (0.0, None)
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        main.get_clients, main.get_workout_logger = self.originals
+        main._recent_workouts_cache = (0.0, None)
+
+    def test_log_during_recent_query_is_not_cached_over(self):
+        def log_while_reading():
+            self.supabase.on_execute = None
+            self.client.post('/log', json={'input': '5 squats'})
+        self.supabase.on_execute = log_while_reading
+
+        self.assertEqual(self.client.get('/recent').status_code, 200)
+        self.assertEqual(main._recent_workouts_cache, (0.0, None))
+
+
+if __name__ == '__main__':
+    unittest.main()